@@ -31,3 +31,23 @@ EMBEDDING_MODELS = (
 )
 
 IMAGE_MODELS = ('dall-e-2', 'dall-e-3')
+
+# Known server-side limits on prompts per request; anything absent uses the handler default.
+MAX_BATCH_SIZES = {
+    'embedding': 2048,
+}
+
+# Context window sizes (in tokens), used to budget how many prompts fit in one batched request.
+DEFAULT_CONTEXT_LENGTH = 4096
+CONTEXT_LENGTHS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-16k': 16385,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-1106-preview': 128000,
+    'gpt-4-0125-preview': 128000,
+    'gpt-4o': 128000,
+    'babbage-002': 16384,
+    'davinci-002': 16384,
+}
@@ -2,6 +2,7 @@ from typing import Text, List, Dict
 import random
 import time
 import math
+import threading
 
 import openai
 from openai import OpenAI
@@ -108,6 +109,64 @@ def retry_with_exponential_backoff(
     return _retry_with_exponential_backoff
 
 
+class RateLimiter:
+    """
+    Proactive dual-bucket rate limiter bounding both requests per minute and tokens per minute.
+
+    Capacity replenishes continuously at `limit / 60` per second. `consume` blocks until both
+    buckets have room, so callers throttle themselves before dispatching a request instead of
+    relying solely on 429-driven exponential backoff after the fact.
+
+    Slight changes in the implementation, but originally from:
+    https://github.com/openai/openai-cookbook/blob/main/examples/api_request_parallel_processor.py
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_capacity = float(requests_per_minute)
+        self._token_capacity = float(tokens_per_minute)
+        self._last_update = time.time()
+        self._lock = threading.Lock()
+
+    def _replenish(self) -> None:
+        now = time.time()
+        elapsed = now - self._last_update
+        self._request_capacity = min(
+            float(self.requests_per_minute),
+            self._request_capacity + elapsed * self.requests_per_minute / 60,
+        )
+        self._token_capacity = min(
+            float(self.tokens_per_minute),
+            self._token_capacity + elapsed * self.tokens_per_minute / 60,
+        )
+        self._last_update = now
+
+    def consume(self, n_requests: int = 1, n_tokens: int = 0) -> None:
+        """
+        Block until there is capacity for `n_requests` requests and `n_tokens` tokens, then take it.
+
+        Args:
+            n_requests (int): Number of requests about to be dispatched.
+            n_tokens (int): Estimated token weight of those requests.
+        """
+        # oversized demands are capped at bucket size so a single large batch cannot block forever
+        n_requests = min(n_requests, self.requests_per_minute)
+        n_tokens = min(n_tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._replenish()
+                if self._request_capacity >= n_requests and self._token_capacity >= n_tokens:
+                    self._request_capacity -= n_requests
+                    self._token_capacity -= n_tokens
+                    return
+                wait = max(
+                    (n_requests - self._request_capacity) * 60 / self.requests_per_minute,
+                    (n_tokens - self._token_capacity) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait)
+
+
 def truncate_msgs_for_token_limit(messages: List[Dict], model_name: Text, max_tokens: int, truncate: Text = 'first'):
     """
     Truncates message list to fit within the token limit.
@@ -181,6 +240,60 @@ def count_tokens(messages: List[Dict], encoder: tiktoken.core.Encoding, model_na
         )
 
 
+def pack_batches(
+    prompts: List[Text],
+    model_name: Text,
+    max_prompts: int,
+    context_length: int,
+    max_completion_tokens: int = 0,
+) -> List[List[Text]]:
+    """
+    Greedily packs prompts into batches bounded by both a prompt count and the model's context window.
+
+    Each prompt is weighted by its token count plus the completion tokens reserved for it, so a
+    batch grows until either the prompt cap or the token budget is hit. Input order is preserved,
+    allowing completions to be mapped back to rows positionally.
+
+    Args:
+        prompts (List[Text]): Prompts to pack
+        model_name (Text): Model name, used to pick the tokenizer
+        max_prompts (int): Maximum number of prompts per batch
+        context_length (int): Token budget per batch
+        max_completion_tokens (int): Completion tokens reserved per prompt
+
+    Returns:
+        List[List[Text]]: List of prompt batches
+    """
+    encoder = None
+    try:
+        try:
+            encoder = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # tokenizers only differ slightly in vocabulary, so any is good enough for budgeting
+            encoder = tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # tiktoken fetches vocabularies over the network on first use; budgeting should
+        # not take the prediction down, so fall back to a character-based estimate
+        pass
+
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for prompt in prompts:
+        n_tokens = (len(encoder.encode(prompt)) if encoder is not None else len(prompt) // 4) + max_completion_tokens
+        if batch and (
+            len(batch) >= max_prompts or batch_tokens + n_tokens > context_length
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(prompt)
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 def get_available_models(api_key: Text, api_base: Text) -> List[Text]:
     """
     Returns a list of available openai models for the given API key.
@@ -1,13 +1,15 @@
+import io
 import os
-import math
 import json
+import hashlib
+import itertools
+import contextlib
 import shutil
 import tempfile
 import datetime
 import textwrap
-import subprocess
-import concurrent.futures
 from typing import Text, Tuple, Dict, List, Optional, Any
+import httpx
 import openai
 from openai import OpenAI, NotFoundError, AuthenticationError
 import numpy as np
@@ -21,18 +23,30 @@ from mindsdb.integrations.handlers.openai_handler.helpers import (
     truncate_msgs_for_token_limit,
     get_available_models,
     PendingFT,
+    RateLimiter,
+    pack_batches,
 )
 from mindsdb.integrations.handlers.openai_handler.constants import (
     CHAT_MODELS,
     IMAGE_MODELS,
     FINETUNING_MODELS,
     OPENAI_API_BASE,
+    CONTEXT_LENGTHS,
+    DEFAULT_CONTEXT_LENGTH,
+    MAX_BATCH_SIZES,
 )
 from mindsdb.integrations.libs.llm.utils import get_completed_prompts
 from mindsdb.integrations.utilities.handler_utils import get_api_key
 
 logger = log.getLogger(__name__)
 
+# Shared pooled transport for all OpenAI clients created by this handler. Without it, every
+# client builds its own connection pool and each batch pays the TCP+TLS handshake again.
+_HTTP_CLIENT = httpx.Client(
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+    timeout=httpx.Timeout(timeout=600.0, connect=5.0),  # mirrors the openai SDK defaults
+)
+
 
 class OpenAIHandler(BaseMLEngine):
     """
@@ -57,6 +71,7 @@ class OpenAIHandler(BaseMLEngine):
             'embedding',
         ]
         self.rate_limit = 60  # requests per minute
+        self.tokens_per_minute = 90000  # tokens per minute
         self.max_batch_size = 20
         self.default_max_tokens = 100
         self.chat_completion_models = CHAT_MODELS
@@ -64,6 +79,9 @@ class OpenAIHandler(BaseMLEngine):
         # For now this are only used for handlers that inherits OpenAIHandler and don't need to override base methods
         self.api_key_name = getattr(self, 'api_key_name', self.name)
         self.api_base = getattr(self, 'api_base', OPENAI_API_BASE)
+        self._completion_cache = None  # lazily loaded in `_cached_completion`
+        self._api_key = None  # resolved once per handler lifetime in `_get_api_key`
+        self._discovered_max_batch = {}  # server-side batch limits learned per model
 
     def create_engine(self, connection_args: Dict) -> None:
         """
@@ -221,7 +239,8 @@ class OpenAIHandler(BaseMLEngine):
         args = args['using']
         args['target'] = target
         try:
-            api_key = get_api_key(self.api_key_name, args, self.engine_storage)
+            self._api_key = None  # model recreation may change the key, so re-resolve
+            api_key = self._get_api_key(args)
             connection_args = self.engine_storage.get_connection_args()
             api_base = connection_args.get('api_base') or self.api_base or args.get('api_base') or os.environ.get('OPENAI_API_BASE', OPENAI_API_BASE)
             available_models = get_available_models(api_key, api_base)
@@ -388,12 +407,16 @@ class OpenAIHandler(BaseMLEngine):
                     .all(axis=1)
                     .values
                 )[0]
-                contexts = list(df[args['context_column']].apply(lambda x: str(x)))
-                questions = list(df[args['question_column']].apply(lambda x: str(x)))
-                prompts = [
-                    f'Context: {c}\nQuestion: {q}\nAnswer: '
-                    for c, q in zip(contexts, questions)
-                ]
+                # np.char.add dispatches each concatenation to C over fixed-width string arrays
+                contexts = df[args['context_column']].to_numpy(dtype=str)
+                questions = df[args['question_column']].to_numpy(dtype=str)
+                prompts = np.char.add(
+                    np.char.add(
+                        np.char.add(np.char.add('Context: ', contexts), '\nQuestion: '),
+                        questions,
+                    ),
+                    '\nAnswer: ',
+                ).tolist()
 
             elif 'prompt' in args:
                 empty_prompt_ids = []
@@ -454,11 +477,31 @@ class OpenAIHandler(BaseMLEngine):
         # remove prompts without signal from completion queue
         prompts = [j for i, j in enumerate(prompts) if i not in empty_prompt_ids]
 
-        api_key = get_api_key(self.api_key_name, args, self.engine_storage)
+        api_key = self._get_api_key(args)
         api_args = {
             k: v for k, v in api_args.items() if v is not None
         }  # filter out non-specified api args
-        completion = self._completion(model_name, prompts, api_key, api_args, args, df)
+
+        # duplicated inputs yield identical outputs in deterministic row-independent modes,
+        # so only unique prompts are dispatched and results are scattered back by row;
+        # n > 1 returns several completions per prompt, breaking per-prompt bookkeeping
+        mode = args.get('mode', self.default_mode)
+        deterministic = api_args.get('n', 1) == 1 and (
+            mode == 'embedding'
+            or (mode == 'default' and api_args.get('temperature', 0.0) == 0.0)
+        )
+        completion = None
+        # rows where only some template columns are missing yield pd.NA prompts, which
+        # np.unique cannot compare; leave those lists to the regular dispatch path
+        if deterministic and len(prompts) > 1 and all(isinstance(p, str) for p in prompts):
+            uniq, inverse = np.unique(prompts, return_inverse=True)
+            if len(uniq) < len(prompts):
+                uniq_completion = self._cached_completion(
+                    model_name, uniq.tolist(), api_key, api_args, args, df
+                )
+                completion = [uniq_completion[i] for i in inverse]
+        if completion is None:
+            completion = self._cached_completion(model_name, prompts, api_key, api_args, args, df)
 
         # add null completion for empty prompts
         for i in sorted(empty_prompt_ids):
@@ -485,6 +528,121 @@ class OpenAIHandler(BaseMLEngine):
 
         return pred_df
 
+    _CACHE_FOLDER_NAME = 'openai_cache'
+
+    def _get_api_key(self, args: Dict) -> Text:
+        """
+        Resolve the API key, caching it on the handler instance.
+
+        Resolution reads engine storage and may parse config.json from disk, so the result
+        is kept for the handler's lifetime; the key cannot change without recreating the model.
+
+        Args:
+            args (Dict): Parameters for the model.
+
+        Returns:
+            Text: OpenAI API key.
+        """
+        if self._api_key is None:
+            self._api_key = get_api_key(self.api_key_name, args, self.engine_storage)
+        return self._api_key
+
+    def _resolve_max_batch(self, model_name: Text) -> int:
+        """
+        Resolve the maximum number of prompts per request for a model without probing the API.
+
+        Prefers a limit learned from a previous server rejection, then the static table of
+        known limits, then the handler default.
+
+        Args:
+            model_name (Text): OpenAI Model name.
+
+        Returns:
+            int: Maximum number of prompts per request.
+        """
+        return self._discovered_max_batch.get(
+            model_name, MAX_BATCH_SIZES.get(model_name, self.max_batch_size)
+        )
+
+    def _cached_completion(
+        self, model_name: Text, prompts: List[Text], api_key: Text, api_args: Dict, args: Dict, df: pd.DataFrame
+    ) -> List[Any]:
+        """
+        Completion wrapper that reuses stored completions for prompts served before.
+
+        Completions are cached only for deterministic requests (temperature 0) in default mode,
+        keyed by a hash of the model, endpoint and all API arguments plus the prompt. The cache is held
+        in-process for the lifetime of the handler and persisted to the engine storage so
+        repeated predictions skip the API entirely for known prompts.
+
+        Args:
+            model_name (Text): OpenAI Model name.
+            prompts (List[Text]): List of prompts.
+            api_key (Text): OpenAI API key.
+            api_args (Dict): OpenAI API arguments.
+            args (Dict): Parameters for the model.
+            df (pd.DataFrame): Input data to run completion on.
+
+        Returns:
+            List[Any]: List of completions, in the same order as the input prompts.
+        """
+        temperature = api_args.get('temperature', 0.0)
+        if (
+            temperature != 0.0
+            or args.get('mode', self.default_mode) != 'default'
+            or api_args.get('n', 1) != 1
+        ):
+            # non-deterministic or conversational outputs cannot be reused safely, and
+            # n > 1 returns several completions per prompt, breaking per-prompt bookkeeping
+            return self._completion(model_name, prompts, api_key, api_args, args, df)
+
+        # storage may be unavailable (e.g. mocked out in tests); degrade to the in-memory tier
+        cache_path = None
+        try:
+            cache_folder = self.engine_storage.folder_get(self._CACHE_FOLDER_NAME)
+            cache_path = os.path.join(cache_folder, 'completions.json')
+        except (OSError, TypeError):
+            pass
+
+        if self._completion_cache is None:
+            self._completion_cache = {}
+            if cache_path is not None:
+                try:
+                    with open(cache_path, 'r') as f:
+                        self._completion_cache = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    pass
+
+        # every output-affecting parameter participates in the key, so a later predict
+        # with different sampling args or endpoint never replays stale completions
+        key_prefix = json.dumps(
+            {'model': model_name, 'api_base': args.get('api_base'), **api_args},
+            sort_keys=True,
+            default=str,
+        )
+        keys = [
+            hashlib.sha256(f'{key_prefix}|{prompt}'.encode('utf-8')).hexdigest()
+            for prompt in prompts
+        ]
+
+        miss_ids = [i for i, key in enumerate(keys) if key not in self._completion_cache]
+        if miss_ids:
+            misses = self._completion(
+                model_name, [prompts[i] for i in miss_ids], api_key, api_args, args, df
+            )
+            for i, completion in zip(miss_ids, misses):
+                self._completion_cache[keys[i]] = completion
+            if cache_path is not None:
+                try:
+                    os.makedirs(cache_folder, exist_ok=True)
+                    with open(cache_path, 'w') as f:
+                        json.dump(self._completion_cache, f)
+                    self.engine_storage.folder_sync(self._CACHE_FOLDER_NAME)
+                except (OSError, TypeError):
+                    logger.debug('Could not persist the completion cache; continuing with the in-memory tier only.')
+
+        return [self._completion_cache[key] for key in keys]
+
     def _completion(
         self, model_name: Text, prompts: List[Text], api_key: Text, api_args: Dict, args: Dict, df: pd.DataFrame, parallel: bool = True
     ) -> List[Any]:
@@ -493,6 +651,7 @@ class OpenAIHandler(BaseMLEngine):
 
         This method consists of several inner methods:
             - _submit_completion: Submit a request to the relevant completion endpoint of the OpenAI API based on the type of task.
+            - _throttled_completion: Acquire proactive rate-limit capacity for a batch before submitting it.
             - _submit_normal_completion: Submit a request to the completion endpoint of the OpenAI API.
             - _submit_embedding_completion: Submit a request to the embeddings endpoint of the OpenAI API.
             - _submit_chat_completion: Submit a request to the chat completion endpoint of the OpenAI API.
@@ -518,6 +677,7 @@ class OpenAIHandler(BaseMLEngine):
         Returns:
             List[Any]: List of completions. The type of completion depends on the task type.
         """
+        import concurrent.futures  # deferred: only the parallel fan-out path needs it
 
         @retry_with_exponential_backoff()
         def _submit_completion(model_name: Text, prompts: List[Text], api_args: Dict, args: Dict, df: pd.DataFrame) -> List[Text]:
@@ -805,60 +965,117 @@ class OpenAIHandler(BaseMLEngine):
             org=args.pop('api_organization') if 'api_organization' in args else None,
         )
 
-        try:
-            # check if simple completion works
-            completion = _submit_completion(
-                model_name, prompts, api_args, args, df
-            )
-            return completion
-        except Exception as e:
-            # else, we get the max batch size
-            if 'you can currently request up to at most a total of' in str(e):
-                pattern = 'a total of'
-                max_batch_size = int(e[e.find(pattern) + len(pattern):].split(').')[0])
+        limiter = RateLimiter(self.rate_limit, self.tokens_per_minute)
+        max_tokens = api_args.get('max_tokens', 0)
+
+        def _throttled_completion(model_name: Text, prompts: List[Text], api_args: Dict, args: Dict, df: pd.DataFrame) -> List[Text]:
+            """
+            Acquire rate-limit capacity for a batch before submitting it.
+
+            The token weight is estimated as ~4 characters per prompt token plus the
+            maximum completion tokens per prompt. The request weight accounts for how the
+            batch is actually dispatched: the chat and image paths issue one HTTP request
+            per prompt, while the other endpoints take the batch as a single request.
+            Exponential backoff still covers any 429 that slips through.
+
+            Args:
+                model_name (Text): OpenAI Model name.
+                prompts (List[Text]): Batch of prompts.
+                api_args (Dict): OpenAI API arguments.
+                args (Dict): Parameters for the model.
+                df (pd.DataFrame): Input data to run completion on.
+
+            Returns:
+                List[Text]: List of completions.
+            """
+            token_estimate = sum(len(p) for p in prompts) // 4 + max_tokens * len(prompts)
+            if model_name in IMAGE_MODELS:
+                n_requests = len(prompts)
+            elif model_name in self.chat_completion_models and model_name != 'gpt-3.5-turbo-instruct':
+                # in conversational mode only the last row triggers a request
+                n_requests = 1 if args.get('mode', 'conversational') == 'conversational' else len(prompts)
             else:
-                max_batch_size = (
-                    self.max_batch_size
-                )  # guards against changes in the API message
+                n_requests = 1
+            limiter.consume(n_requests=n_requests, n_tokens=token_estimate)
+            try:
+                return _submit_completion(model_name, prompts, api_args, args, df)
+            except Exception as e:
+                # defense-in-depth: if the server still rejects the batch size, learn
+                # its limit, remember it and resubmit in smaller chunks
+                msg = str(e)
+                if 'you can currently request up to at most a total of' in msg and len(prompts) > 1:
+                    pattern = 'a total of'
+                    server_max = int(msg[msg.find(pattern) + len(pattern):].split(').')[0])
+                    self._discovered_max_batch[model_name] = server_max
+                    completion = []
+                    for i in range(0, len(prompts), server_max):
+                        completion.extend(
+                            _throttled_completion(
+                                model_name, prompts[i: i + server_max], api_args, args, df
+                            )
+                        )
+                    return completion
+                raise
+
+        if args.get('mode', self.default_mode) in ('conversational', 'conversational-full'):
+            # a conversation must be seen whole; the chat path iterates over rows internally
+            return _throttled_completion(model_name, prompts, api_args, args, df)
+
+        max_batch_size = self._resolve_max_batch(model_name)
+
+        # pack prompts by token budget so each request uses as much of the
+        # context window as it can, instead of always sending fixed-size chunks
+        batches = pack_batches(
+            prompts,
+            model_name,
+            max_prompts=max_batch_size,
+            context_length=CONTEXT_LENGTHS.get(model_name, DEFAULT_CONTEXT_LENGTH),
+            # endpoints without a max_tokens arg (e.g. embeddings) produce no completion
+            # tokens, so nothing is reserved for them — consistent with the limiter above
+            max_completion_tokens=api_args.get('max_tokens', 0),
+        )
+
+        if len(batches) == 1:
+            return _throttled_completion(model_name, batches[0], api_args, args, df)
 
         if not parallel:
-            completion = None
-            for i in range(math.ceil(len(prompts) / max_batch_size)):
-                partial = _submit_completion(
-                    model_name,
-                    prompts[i * max_batch_size: (i + 1) * max_batch_size],
-                    api_args,
-                    args,
-                    df,
+            completion = []
+            for batch in batches:
+                completion.extend(
+                    _throttled_completion(
+                        model_name,
+                        batch,
+                        api_args,
+                        args,
+                        df,
+                    )
                 )
-                if not completion:
-                    completion = partial
-                else:
-                    completion['choices'].extend(partial['choices'])
-                    for field in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
-                        completion['usage'][field] += partial['usage'][field]
         else:
-            promises = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                for i in range(math.ceil(len(prompts) / max_batch_size)):
+            num_batches = len(batches)
+            results = [None] * num_batches
+            # these calls are purely I/O-bound, so size the pool by the rate
+            # limit rather than the CPU-count default to keep all batches in flight
+            max_workers = min(num_batches, self.rate_limit)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for i, batch in enumerate(batches):
                     logger.debug(
-                        f'{i * max_batch_size}:{(i+1) * max_batch_size}/{len(prompts)}'
+                        f'batch {i + 1}/{num_batches}: {len(batch)} prompts'
                     )
                     future = executor.submit(
-                        _submit_completion,
+                        _throttled_completion,
                         model_name,
-                        prompts[i * max_batch_size: (i + 1) * max_batch_size],
+                        batch,
                         api_args,
                         args,
                         df,
                     )
-                    promises.append({"choices": future})
-            completion = None
-            for p in promises:
-                if not completion:
-                    completion = p['choices'].result()
-                else:
-                    completion.extend(p['choices'].result())
+                    futures[future] = i
+                # collect batches as they finish, slotting each into its
+                # submission position so the output order stays stable
+                for future in concurrent.futures.as_completed(futures):
+                    results[futures[future]] = future.result()
+            completion = list(itertools.chain.from_iterable(results))
 
         return completion
 
@@ -875,7 +1092,7 @@ class OpenAIHandler(BaseMLEngine):
         # TODO: Update to use update() artifacts
 
         args = self.model_storage.json_get('args')
-        api_key = get_api_key(self.api_key_name, args, self.engine_storage)
+        api_key = self._get_api_key(args)
         if attribute == 'args':
             return pd.DataFrame(args.items(), columns=['key', 'value'])
         elif attribute == 'metadata':
@@ -922,7 +1139,7 @@ class OpenAIHandler(BaseMLEngine):
         """  # noqa
         args = args if args else {}
 
-        api_key = get_api_key(self.api_key_name, args, self.engine_storage)
+        api_key = self._get_api_key(args)
 
         using_args = args.pop('using') if 'using' in args else {}
 
@@ -1032,23 +1249,39 @@ class OpenAIHandler(BaseMLEngine):
         Returns:
             Dict: File names for the fine-tuning process.
         """
-        df.to_json(temp_model_path, orient='records', lines=True)
-
-        # TODO avoid subprocess usage once OpenAI enables non-CLI access, or refactor to use our own LLM utils instead
-        subprocess.run(
-            [
-                "openai",
-                "tools",
-                "fine_tunes.prepare_data",
-                "-f",
-                temp_model_path,  # from file
-                '-q',  # quiet mode (accepts all suggestions)
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",
+        # deferred imports: orjson and the openai validators tree are only needed for fine-tuning
+        import orjson
+        from openai.lib._validators import (
+            read_any_format,
+            get_validators,
+            apply_validators,
+            apply_necessary_remediation,
+            write_out_file,
         )
 
+        # orjson serializes each record straight to UTF-8 bytes, skipping pandas' Python-level JSON
+        # encoder; default=str covers types orjson does not handle natively (e.g. pd.Timestamp)
+        with open(temp_model_path, 'wb') as f:
+            for row in df.to_dict('records'):
+                f.write(orjson.dumps(row, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE))
+
+        # run the data preparation tool in-process; the `openai tools fine_tunes.prepare_data`
+        # CLI command is a thin wrapper over these validators  # TODO refactor to use our own LLM utils instead
+        # the validators print their full report to stdout, so capture it for the debug log
+        prepare_report = io.StringIO()
+        with contextlib.redirect_stdout(prepare_report):
+            df_ft, remediation = read_any_format(temp_model_path)
+            apply_necessary_remediation(None, remediation)
+            apply_validators(
+                df_ft,
+                temp_model_path,
+                remediation,
+                get_validators(),
+                auto_accept=True,  # accepts all suggestions, like the CLI's quiet mode
+                write_out_file_func=write_out_file,
+            )
+        logger.debug(f'Fine-tune data preparation report:\n{prepare_report.getvalue()}')
+
         file_names = {
             'original': f'{temp_filename}.jsonl',
             'base': f'{temp_filename}_prepared.jsonl',
@@ -1178,4 +1411,4 @@ class OpenAIHandler(BaseMLEngine):
         Returns:
             openai.OpenAI: OpenAI client.
         """
-        return OpenAI(api_key=api_key, base_url=base_url, organization=org)
+        return OpenAI(api_key=api_key, base_url=base_url, organization=org, http_client=_HTTP_CLIENT)
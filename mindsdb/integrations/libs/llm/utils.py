@@ -1,4 +1,5 @@
 from typing import Optional, Dict, List, Tuple
+import functools
 import json
 import itertools
 import re
@@ -44,6 +45,9 @@ DEFAULT_NVIDIA_NIM_BASE_URL = (
 )
 DEFAULT_NVIDIA_NIM_MODEL = "meta/llama-3_1-8b-instruct"
 
+# Matches `{{column_name}}` placeholders in prompt templates.
+_TEMPLATE_RE = re.compile(r"\{\{(.*?)\}\}")
+
 
 def get_completed_prompts(
     base_template: str, df: pd.DataFrame, strict=True
@@ -61,7 +65,7 @@ def get_completed_prompts(
     """  # noqa
     columns = []
     spans = []
-    matches = list(re.finditer("{{(.*?)}}", base_template))
+    matches = list(_TEMPLATE_RE.finditer(base_template))
 
     if len(matches) == 0:
         # no placeholders
@@ -76,7 +80,7 @@ def get_completed_prompts(
     last_span = matches[-1].end()
 
     for m in matches:
-        columns.append(m[0].replace("{", "").replace("}", ""))
+        columns.append(m.group(1))
         spans.extend((m.start(), m.end()))
 
     spans = spans[1:-1]  # omit first and last, they are added separately
@@ -88,19 +92,16 @@ def get_completed_prompts(
 
     empty_prompt_ids = np.where(df[columns].isna().all(axis=1).values)[0]
 
-    df["__mdb_prompt"] = ""
-    for i in range(len(template)):
-        atom = template[i]
+    # fuse template atoms and column values in a single vectorized pass
+    parts = []
+    for i, atom in enumerate(template):
+        parts.append(pd.Series(atom, index=df.index, dtype="string"))
         if i < len(columns):
             col = df[columns[i]].replace(
                 to_replace=[None], value=""
             )  # add empty quote if data is missing
-            df["__mdb_prompt"] = df["__mdb_prompt"].apply(
-                lambda x: x + atom
-            ) + col.astype("string")
-        else:
-            df["__mdb_prompt"] = df["__mdb_prompt"].apply(lambda x: x + atom)
-    prompts = list(df["__mdb_prompt"])
+            parts.append(col.astype("string"))
+    prompts = list(functools.reduce(lambda a, b: a.str.cat(b), parts))
 
     return prompts, empty_prompt_ids
 
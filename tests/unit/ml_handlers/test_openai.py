@@ -1,9 +1,14 @@
+import time
+import shutil
+import tempfile
+
 import pandas
 import unittest
 from collections import OrderedDict
 from unittest.mock import patch, MagicMock
 
 from mindsdb.integrations.handlers.openai_handler.openai_handler import OpenAIHandler
+from mindsdb.integrations.handlers.openai_handler.helpers import RateLimiter, pack_batches
 
 
 class TestOpenAI(unittest.TestCase):
@@ -23,6 +28,11 @@ class TestOpenAI(unittest.TestCase):
         # Define a return value for the `get_connection_args` method of the mock engine storage
         mock_engine_storage.get_connection_args.return_value = self.dummy_connection_data
 
+        # Cached completions are persisted through the engine storage; point them at a throwaway folder
+        cache_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_folder, ignore_errors=True)
+        mock_engine_storage.folder_get.return_value = cache_folder
+
         # Assign mock engine storage to instance variable for create validation tests
         self.mock_engine_storage = mock_engine_storage
 
@@ -557,6 +567,104 @@ class TestOpenAI(unittest.TestCase):
 
         pandas.testing.assert_frame_equal(result, pandas.DataFrame({'answer': ['Stockholm', 'Gamla Stan']}))
 
+    @patch('mindsdb.integrations.handlers.openai_handler.openai_handler.OpenAI')
+    def test_predict_in_default_mode_reuses_cached_completions(self, mock_openai_handler_openai_client):
+        """
+        Test if deterministic predictions are cached and reused without calling the API again.
+        """
+
+        # Mock the json_get method of the model storage
+        self.handler.model_storage.json_get.return_value = {
+            'target': 'answer',
+            'mode': 'default',
+            'model_name': 'gpt-3.5-turbo',
+            'question_column': 'question'
+        }
+
+        # Mock the chat.completions.create method of the OpenAI client
+        mock_openai_client = MagicMock()
+        mock_openai_client.chat.completions.create.return_value = MagicMock(
+            choices=[
+                MagicMock(
+                    message=MagicMock(
+                        content='Sweden'
+                    )
+                )
+            ]
+        )
+
+        mock_openai_handler_openai_client.return_value = mock_openai_client
+
+        df = pandas.DataFrame({'question': ['Where is Stockholm located?']})
+
+        self.handler.predict(df, args={})
+        self.assertEqual(mock_openai_client.chat.completions.create.call_count, 1)
+
+        # A repeated prediction is served from the in-memory cache
+        result = self.handler.predict(df, args={})
+        self.assertEqual(mock_openai_client.chat.completions.create.call_count, 1)
+
+        pandas.testing.assert_frame_equal(result, pandas.DataFrame({'answer': ['Sweden']}))
+
+        # A fresh handler reloads the cache persisted to engine storage
+        new_handler = OpenAIHandler(self.handler.model_storage, self.mock_engine_storage, connection_data={'connection_data': self.dummy_connection_data})
+        result = new_handler.predict(df, args={})
+        self.assertEqual(mock_openai_client.chat.completions.create.call_count, 1)
+
+        pandas.testing.assert_frame_equal(result, pandas.DataFrame({'answer': ['Sweden']}))
+
+    @patch('mindsdb.integrations.handlers.openai_handler.openai_handler.OpenAI')
+    def test_predict_in_default_mode_dispatches_duplicated_prompts_once(self, mock_openai_handler_openai_client):
+        """
+        Test if duplicated prompts are sent to the API only once and results map back to the right rows.
+        """
+
+        # Mock the json_get method of the model storage
+        self.handler.model_storage.json_get.return_value = {
+            'target': 'answer',
+            'mode': 'default',
+            'model_name': 'gpt-3.5-turbo',
+            'question_column': 'question'
+        }
+
+        # Mock the chat.completions.create method of the OpenAI client to answer based on the question asked
+        answers = {
+            'What is the capital of Sweden?': 'Stockholm',
+            'What is the capital of Norway?': 'Oslo'
+        }
+
+        def _answer_question(**kwargs):
+            content = answers[kwargs['messages'][-1]['content']]
+            return MagicMock(
+                choices=[
+                    MagicMock(
+                        message=MagicMock(
+                            content=content
+                        )
+                    )
+                ]
+            )
+
+        mock_openai_client = MagicMock()
+        mock_openai_client.chat.completions.create.side_effect = _answer_question
+
+        mock_openai_handler_openai_client.return_value = mock_openai_client
+
+        df = pandas.DataFrame(
+            {
+                'question': [
+                    'What is the capital of Sweden?',
+                    'What is the capital of Norway?',
+                    'What is the capital of Sweden?'
+                ]
+            }
+        )
+        result = self.handler.predict(df, args={})
+
+        self.assertEqual(mock_openai_client.chat.completions.create.call_count, 2)
+
+        pandas.testing.assert_frame_equal(result, pandas.DataFrame({'answer': ['Stockholm', 'Oslo', 'Stockholm']}))
+
     def test_describe_runs_no_errors(self):
         """
         Test if model describe returns the expected result.
@@ -670,5 +778,80 @@ class TestOpenAI(unittest.TestCase):
     # TODO: Add more unit tests for the finetune method
 
 
+class TestOpenAIHelpers(unittest.TestCase):
+    """
+    Unit tests for the OpenAI handler helpers.
+    """
+
+    def test_rate_limiter_consume_with_available_capacity_does_not_block(self):
+        """
+        Test if the rate limiter lets a request through immediately when both buckets have room.
+        """
+
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=90000)
+
+        start = time.time()
+        limiter.consume(n_requests=1, n_tokens=100)
+
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_rate_limiter_consume_with_drained_bucket_blocks_until_replenished(self):
+        """
+        Test if the rate limiter blocks when the token bucket is drained and resumes once it replenishes.
+        """
+
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+
+        # Drain the token bucket; it replenishes at 100 tokens per second
+        limiter.consume(n_tokens=6000)
+
+        start = time.time()
+        limiter.consume(n_tokens=20)
+
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+    @patch('mindsdb.integrations.handlers.openai_handler.helpers.tiktoken')
+    def test_pack_batches_splits_on_prompt_count_and_preserves_order(self, mock_tiktoken):
+        """
+        Test if batch packing respects the prompt cap and keeps the input order.
+        """
+
+        # Mock the tokenizer to weigh every prompt as a single token
+        mock_tiktoken.encoding_for_model.return_value.encode.side_effect = lambda prompt: [0]
+
+        prompts = [f'prompt_{i}' for i in range(5)]
+        batches = pack_batches(prompts, 'dummy_model_name', max_prompts=2, context_length=4096)
+
+        self.assertEqual(batches, [['prompt_0', 'prompt_1'], ['prompt_2', 'prompt_3'], ['prompt_4']])
+
+    @patch('mindsdb.integrations.handlers.openai_handler.helpers.tiktoken')
+    def test_pack_batches_splits_on_token_budget(self, mock_tiktoken):
+        """
+        Test if batch packing closes a batch once the token budget is exhausted.
+        """
+
+        # Mock the tokenizer to weigh every prompt by its character count
+        mock_tiktoken.encoding_for_model.return_value.encode.side_effect = lambda prompt: [0] * len(prompt)
+
+        prompts = ['aaaa', 'bbbb', 'cccc']
+        batches = pack_batches(prompts, 'dummy_model_name', max_prompts=20, context_length=8)
+
+        self.assertEqual(batches, [['aaaa', 'bbbb'], ['cccc']])
+
+    @patch('mindsdb.integrations.handlers.openai_handler.helpers.tiktoken')
+    def test_pack_batches_reserves_completion_tokens(self, mock_tiktoken):
+        """
+        Test if batch packing accounts for the completion tokens reserved per prompt.
+        """
+
+        # Mock the tokenizer to weigh every prompt by its character count
+        mock_tiktoken.encoding_for_model.return_value.encode.side_effect = lambda prompt: [0] * len(prompt)
+
+        prompts = ['aaaa', 'bbbb', 'cccc']
+        batches = pack_batches(prompts, 'dummy_model_name', max_prompts=20, context_length=8, max_completion_tokens=4)
+
+        self.assertEqual(batches, [['aaaa'], ['bbbb'], ['cccc']])
+
+
 if __name__ == '__main__':
     unittest.main()